@@ -3,14 +3,70 @@ iCloud Calendar Sync using CalDAV
 """
 import caldav
 from caldav.elements import dav, cdav
-from icalendar import Calendar, Event as ICalEvent
+import hashlib
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple, Callable, Collection
+from urllib.parse import quote
 import logging
 from chronos_parser import ChronosEvent
+from http_session import configure_session
 
 logger = logging.getLogger(__name__)
 
+# Concurrent CalDAV requests, each one is a full network round-trip
+MAX_WORKERS = 8
+
+# Category and UID suffix marking the events managed by this app
+CHRONOS_CATEGORY = 'CHRONOS-SYNC'
+RESOURCE_SUFFIX = f'-{CHRONOS_CATEGORY}.ics'
+
+# Every event has the same structure, so the VCALENDAR is formatted directly
+ICAL_TEMPLATE = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//Chronos Calendar Sync//EN\r\n"
+    "BEGIN:VEVENT\r\n"
+    "{body}"
+    "END:VEVENT\r\n"
+    "END:VCALENDAR\r\n"
+)
+
+
+def _escape(text: str) -> str:
+    """Escape a TEXT value (RFC 5545 section 3.3.11)"""
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line: str) -> str:
+    """Fold a content line to 75 octets (RFC 5545 section 3.1)"""
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    
+    parts = []
+    current = ''
+    size = 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > 75:
+            parts.append(current)
+            # Continuation lines start with a space
+            current = ''
+            size = 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _format_datetime(value: datetime) -> str:
+    """Format a DATE-TIME value, floating if naive and UTC otherwise"""
+    if value.tzinfo is None:
+        return value.strftime('%Y%m%dT%H%M%S')
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
 
 class CalendarSync:
     """Syncs events to iCloud calendar using CalDAV"""
@@ -22,6 +78,7 @@ class CalendarSync:
         self.calendar_name = calendar_name
         self.client = None
         self.calendar = None
+        self.calendar_href = None
         
     def connect(self) -> bool:
         """Connect to CalDAV server and get/create calendar"""
@@ -32,6 +89,10 @@ class CalendarSync:
                 username=self.username,
                 password=self.password
             )
+            # Reuse connections across the event PUT/DELETE requests
+            # Newer caldav releases use a niquests session, which keeps its own setup
+            if isinstance(self.client.session, requests.Session):
+                configure_session(self.client.session)
             
             principal = self.client.principal()
             calendars = principal.calendars()
@@ -47,6 +108,9 @@ class CalendarSync:
                 logger.info(f"Creating new calendar: {self.calendar_name}")
                 self.calendar = principal.make_calendar(name=self.calendar_name)
             
+            # Events are stored at <calendar>/<uid>.ics, like caldav's save_event does
+            self.calendar_href = str(self.calendar.url).rstrip('/')
+            
             return True
             
         except Exception as e:
@@ -55,8 +119,8 @@ class CalendarSync:
     
     def sync_events(self, events: List[ChronosEvent]) -> bool:
         """
-        Sync events to calendar
-        Removes old events and adds new ones
+        Full sync of events to calendar
+        Removes old events and adds new ones, use sync_changes for incremental updates
         """
         if not self.calendar:
             logger.error("No calendar connection")
@@ -77,43 +141,132 @@ class CalendarSync:
             self._clear_existing_events(start_date, end_date)
             
             # Add new events
-            for event in events:
-                self._add_event(event)
+            success = self._upload_events(events)
             
-            logger.info("Sync completed successfully")
-            return True
+            if success:
+                logger.info("Sync completed successfully")
+            return success
             
         except Exception as e:
             logger.error(f"Error syncing events: {e}")
             return False
     
-    def _clear_existing_events(self, start_date: datetime, end_date: datetime):
-        """Remove existing Chronos events in the date range"""
+    def sync_changes(self, new_events: List[ChronosEvent], deleted_events: List[Dict],
+                     modified_events: List[Tuple[Dict, ChronosEvent]]) -> bool:
+        """
+        Apply an incremental diff to the calendar
+        Only deletes removed events and uploads new/modified ones
+        
+        Args:
+            new_events: Events not present in the previous sync
+            deleted_events: Event dicts (from ChangeDetector) no longer in Chronos
+            modified_events: List of (old_dict, new_event) tuples
+        """
+        if not self.calendar:
+            logger.error("No calendar connection")
+            return False
+        
+        if not (new_events or deleted_events or modified_events):
+            logger.info("Calendar already up to date")
+            return True
+        
+        logger.info(f"Applying changes: {len(new_events)} new, {len(deleted_events)} deleted, "
+                    f"{len(modified_events)} modified")
+        
         try:
-            # Search for events in the date range
-            events = self.calendar.date_search(
-                start=start_date,
-                end=end_date,
-                expand=True
-            )
+            # Each Chronos event has its own resource, a modified event keeps its UID
+            stale_uids = {self._event_uid(d['uid']) for d in deleted_events}
+            success = self._run_parallel(self._delete_event, stale_uids) == len(stale_uids)
+            
+            # Saving with the same UID overwrites the existing resource in place
+            events = new_events + [event for _, event in modified_events]
+            success = self._upload_events(events) and success
             
-            deleted_count = 0
-            for event in events:
+            if success:
+                logger.info("Changes applied successfully")
+            return success
+            
+        except Exception as e:
+            logger.error(f"Error applying changes: {e}")
+            return False
+    
+    @staticmethod
+    def _run_parallel(func: Callable[..., bool], items: Collection) -> int:
+        """Run func over items on a thread pool, returns how many calls succeeded"""
+        succeeded = 0
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
                 try:
-                    # Check if this is a Chronos event by UID pattern
-                    cal_data = event.data
-                    
-                    # Check for our UID pattern or CHRONOS-SYNC category
-                    if ('chronos-' in cal_data.lower() and 'CHRONOS-SYNC' in cal_data) or \
-                       'CATEGORY:CHRONOS-SYNC' in cal_data:
-                        logger.debug(f"Deleting event: {event.url}")
-                        event.delete()
-                        deleted_count += 1
+                    if future.result():
+                        succeeded += 1
                 except Exception as e:
-                    logger.warning(f"Could not delete event: {e}")
+                    logger.error(f"✗ Error processing {futures[future]}: {e}")
+        return succeeded
+    
+    @staticmethod
+    def _event_uid(unique_id: str) -> str:
+        """
+        Build the deterministic CalDAV UID of a Chronos event from its unique id
+        Hashed, the unique id holds characters that don't belong in a resource name
+        """
+        digest = hashlib.blake2b(unique_id.encode('utf-8'), digest_size=16).hexdigest()
+        return f"chronos-{digest}-{CHRONOS_CATEGORY}"
+    
+    def _event_url(self, uid: str) -> str:
+        """URL of the calendar resource holding an event"""
+        return f"{self.calendar_href}/{quote(uid)}.ics"
+    
+    def _delete_event(self, uid: str) -> bool:
+        """Delete a single event by UID with a raw DELETE, a missing event counts as deleted"""
+        try:
+            response = self.client.delete(self._event_url(uid))
+            if response.status == 404:
+                logger.debug(f"Event already absent: {uid}")
+                return True
+            if response.status >= 400:
+                raise Exception(f"HTTP {response.status} {response.reason}")
+            logger.info(f"✓ Deleted event: {uid}")
+            return True
+        except Exception as e:
+            logger.error(f"✗ Error deleting event {uid}: {e}")
+            return False
+    
+    def _find_chronos_events(self, start_date: Optional[datetime] = None,
+                             end_date: Optional[datetime] = None) -> list:
+        """
+        Find our events with a server-side calendar-query on the CHRONOS-SYNC category
+        Only resources named <uid>.ics with our UID suffix are kept, so a server
+        ignoring the filter doesn't get the user's own events deleted
+        """
+        search_args = {'event': True, 'category': CHRONOS_CATEGORY}
+        if start_date and end_date:
+            search_args.update(start=start_date, end=end_date)
+        events = self.calendar.search(**search_args)
+        
+        return [
+            event for event in events
+            if str(event.url).endswith(RESOURCE_SUFFIX)
+        ]
+    
+    def _delete_resource(self, event) -> bool:
+        """Delete an already fetched calendar resource"""
+        try:
+            logger.debug(f"Deleting event: {event.url}")
+            event.delete()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not delete event: {e}")
+            return False
+    
+    def _clear_existing_events(self, start_date: datetime, end_date: datetime):
+        """Remove existing Chronos events in the date range"""
+        try:
+            events = self._find_chronos_events(start_date, end_date)
+            deleted = self._run_parallel(self._delete_resource, events)
             
-            if deleted_count > 0:
-                logger.info(f"Deleted {deleted_count} existing events")
+            if events:
+                logger.info(f"Deleted {deleted} of {len(events)} existing events")
                 
         except Exception as e:
             logger.warning(f"Could not clear existing events: {e}")
@@ -123,104 +276,115 @@ class CalendarSync:
         try:
             logger.info("Searching for all CHRONOS-SYNC events to delete...")
             
-            # Get all events from calendar
-            all_events = self.calendar.events()
-            
-            deleted_count = 0
-            for event in all_events:
-                try:
-                    cal_data = event.data
-                    
-                    # Check if this is a Chronos event
-                    if ('chronos-' in cal_data.lower() and 'CHRONOS-SYNC' in cal_data) or \
-                       'CATEGORY:CHRONOS-SYNC' in cal_data:
-                        logger.debug(f"Deleting event: {event.url}")
-                        event.delete()
-                        deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Could not delete event: {e}")
+            events = self._find_chronos_events()
+            deleted = self._run_parallel(self._delete_resource, events)
             
-            logger.info(f"Deleted {deleted_count} total CHRONOS-SYNC events")
-            return deleted_count
+            logger.info(f"Deleted {deleted} of {len(events)} total CHRONOS-SYNC events")
+            return deleted
             
         except Exception as e:
             logger.error(f"Error clearing all events: {e}")
             return 0
     
-    def _add_event(self, chronos_event: ChronosEvent):
-        """Add a single event to the calendar"""
-        try:
+    def _upload_events(self, events: List[ChronosEvent]) -> bool:
+        """
+        Upload events, one calendar resource per UID
+        All payloads are serialized first so the worker threads only do network I/O
+        """
+        payloads = []
+        success = True
+        for chronos_event in events:
             if not chronos_event.start:
                 logger.warning(f"Skipping event without start date: {chronos_event.title}")
-                return
-            
-            logger.info(f"Creating event: {chronos_event.get_calendar_title()}")
-            logger.debug(f"  Event details: type={chronos_event.event_id}, code={chronos_event.code}")
-            logger.debug(f"  Start: {chronos_event.start}, End: {chronos_event.end}")
-            logger.debug(f"  All-day: {chronos_event.all_day}")
-            
-            # Create iCalendar event
-            cal = Calendar()
-            cal.add('prodid', '-//Chronos Calendar Sync//EN')
-            cal.add('version', '2.0')
-            
-            event = ICalEvent()
-            
-            # Generate unique UID
-            uid = f"chronos-{chronos_event.code}-{chronos_event.start.strftime('%Y%m%d')}-CHRONOS-SYNC"
-            event.add('uid', uid)
-            logger.debug(f"  UID: {uid}")
-            
-            # Add summary (title)
-            title = chronos_event.get_calendar_title()
-            event.add('summary', title)
-            logger.debug(f"  Title: {title}")
-            
-            # Add description
-            description = chronos_event.get_calendar_description()
-            event.add('description', description)
-            logger.debug(f"  Description: {description}")
-            
-            # Add dates
-            if chronos_event.all_day:
-                # All-day event
-                start_date = chronos_event.start.date()
-                end_date = chronos_event.end.date() if chronos_event.end and chronos_event.end != chronos_event.start else chronos_event.start.date()
-                event.add('dtstart', start_date)
-                event.add('dtend', end_date)
-                logger.debug(f"  All-day event: {start_date} to {end_date}")
-            else:
-                # Timed event
-                start_time = chronos_event.start
-                end_time = chronos_event.end if chronos_event.end else chronos_event.start
-                event.add('dtstart', start_time)
-                event.add('dtend', end_time)
-                logger.debug(f"  Timed event: {start_time} to {end_time}")
-            
-            # Add timestamp
-            event.add('dtstamp', datetime.now(timezone.utc))
-            
-            # Add categories for filtering
-            categories = ['CHRONOS-SYNC']
-            if chronos_event.event_id:
-                categories.append(chronos_event.event_id)
-            if chronos_event.code:
-                categories.append(chronos_event.code)
-            event.add('categories', categories)
-            logger.debug(f"  Categories: {', '.join(categories)}")
-            
-            cal.add_component(event)
-            
-            # Save to calendar
-            ical_data = cal.to_ical().decode('utf-8')
-            logger.debug(f"  iCal data length: {len(ical_data)} bytes")
-            self.calendar.save_event(ical_data)
+                continue
+            try:
+                payloads.append((
+                    chronos_event.get_calendar_title(),
+                    self._event_uid(chronos_event.get_unique_id()),
+                    self._build_ical(chronos_event)
+                ))
+            except Exception as e:
+                logger.error(f"✗ Error preparing event {chronos_event.title}: {e}")
+                success = False
+        
+        return self._run_parallel(self._save_ical, payloads) == len(payloads) and success
+    
+    def _build_ical(self, chronos_event: ChronosEvent) -> str:
+        """Serialize a single event as a VCALENDAR document"""
+        logger.info(f"Creating event: {chronos_event.get_calendar_title()}")
+        logger.debug("  Event details: type=%s, code=%s", chronos_event.event_id, chronos_event.code)
+        logger.debug("  Start: %s, End: %s", chronos_event.start, chronos_event.end)
+        logger.debug("  All-day: %s", chronos_event.all_day)
+        
+        # Generate unique UID
+        uid = self._event_uid(chronos_event.get_unique_id())
+        logger.debug("  UID: %s", uid)
+        
+        title = chronos_event.get_calendar_title()
+        logger.debug("  Title: %s", title)
+        
+        description = chronos_event.get_calendar_description()
+        logger.debug("  Description: %s", description)
+        
+        # Add dates
+        if chronos_event.all_day:
+            # All-day event
+            start_date = chronos_event.start.date()
+            end_date = chronos_event.end.date() if chronos_event.end and chronos_event.end != chronos_event.start else chronos_event.start.date()
+            dtstart = f"DTSTART;VALUE=DATE:{start_date.strftime('%Y%m%d')}"
+            dtend = f"DTEND;VALUE=DATE:{end_date.strftime('%Y%m%d')}"
+            logger.debug("  All-day event: %s to %s", start_date, end_date)
+        else:
+            # Timed event
+            start_time = chronos_event.start
+            end_time = chronos_event.end if chronos_event.end else chronos_event.start
+            dtstart = f"DTSTART:{_format_datetime(start_time)}"
+            dtend = f"DTEND:{_format_datetime(end_time)}"
+            logger.debug("  Timed event: %s to %s", start_time, end_time)
+        
+        # Add categories for filtering
+        categories = [CHRONOS_CATEGORY]
+        if chronos_event.event_id:
+            categories.append(chronos_event.event_id)
+        if chronos_event.code:
+            categories.append(chronos_event.code)
+        logger.debug("  Categories: %s", ', '.join(categories))
+        
+        lines = [
+            f"SUMMARY:{_escape(title)}",
+            dtstart,
+            dtend,
+            f"DTSTAMP:{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}",
+            f"UID:{uid}",
+            f"CATEGORIES:{','.join(_escape(category) for category in categories)}",
+            f"DESCRIPTION:{_escape(description)}"
+        ]
+        ical_data = ICAL_TEMPLATE.format(body=''.join(_fold(line) + '\r\n' for line in lines))
+        logger.debug("  iCal data length: %d bytes", len(ical_data))
+        return ical_data
+    
+    def _save_ical(self, payload: Tuple[str, str, str]) -> bool:
+        """
+        PUT a serialized event straight to its resource URL, returns False if the upload failed
+        Skips caldav's save_event, which parses the iCalendar data again
+        """
+        title, uid, ical_data = payload
+        try:
+            response = self.client.put(
+                self._event_url(uid),
+                ical_data.encode('utf-8'),
+                {'Content-Type': 'text/calendar; charset=utf-8'}
+            )
+            if response.status >= 400:
+                raise Exception(f"HTTP {response.status} {response.reason}")
             logger.info(f"✓ Successfully added event: {title}")
+            return True
             
         except Exception as e:
-            logger.error(f"✗ Error adding event {chronos_event.title}: {e}")
+            logger.error(f"✗ Error adding event {title}: {e}")
             import traceback
             logger.debug(f"  Traceback: {traceback.format_exc()}")
+            return False
     
     def test_connection(self) -> bool:
         """Test if the calendar connection is working"""
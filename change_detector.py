@@ -1,85 +1,336 @@
 """
 Change detection for Chronos events
 """
-import json
+import hashlib
 import logging
+import sqlite3
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Set, Tuple, Iterable, Optional
 from datetime import datetime, timedelta
 from chronos_parser import ChronosEvent
-import locale
 
 logger = logging.getLogger(__name__)
 
-# Set French locale for day names
-try:
-    locale.setlocale(locale.LC_TIME, 'fr_FR.UTF-8')
-except:
-    try:
-        locale.setlocale(locale.LC_TIME, 'fr_FR')
-    except:
-        logger.warning("Could not set French locale, using default")
+# French day names, keyed by the C locale names from strftime('%A')
+DAY_NAMES_FR = {
+    'Monday': 'Lundi',
+    'Tuesday': 'Mardi', 
+    'Wednesday': 'Mercredi',
+    'Thursday': 'Jeudi',
+    'Friday': 'Vendredi',
+    'Saturday': 'Samedi',
+    'Sunday': 'Dimanche'
+}
+
+# French month names, keyed by strftime('%B')
+MONTH_NAMES_FR = {
+    'January': 'Jan', 'February': 'Fev', 'March': 'Mar',
+    'April': 'Avr', 'May': 'Mai', 'June': 'Juin',
+    'July': 'Juil', 'August': 'Aou', 'September': 'Sep',
+    'October': 'Oct', 'November': 'Nov', 'December': 'Dec'
+}
+
+# Previous sync state, one row per event with a hash of its compared fields
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    uid TEXT PRIMARY KEY,
+    title TEXT,
+    start TEXT,
+    "end" TEXT,
+    description TEXT,
+    all_day INTEGER,
+    code TEXT,
+    hash TEXT NOT NULL
+);
+-- Covers the uid -> hash scan done on every diff
+CREATE INDEX IF NOT EXISTS idx_events_uid_hash ON events (uid, hash);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Stored in PRAGMA user_version, bump whenever STATE_SCHEMA changes
+SCHEMA_VERSION = 1
+
+# Write-ahead log, one fsync per checkpoint instead of per commit
+STATE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000"
+)
+
+# Stay well below SQLite's bound parameter limit
+QUERY_CHUNK_SIZE = 500
+
+# Upsert of several event rows per statement, VALUES groups are added per chunk
+STATE_COLUMNS = 8
+UPSERT_ROWS_SQL = """INSERT INTO events (uid, title, start, "end", description, all_day, code, hash)
+VALUES {values}
+ON CONFLICT(uid) DO UPDATE SET
+    title = excluded.title, start = excluded.start, "end" = excluded."end",
+    description = excluded.description, all_day = excluded.all_day,
+    code = excluded.code, hash = excluded.hash"""
+UPSERT_CHUNK_ROWS = QUERY_CHUNK_SIZE // STATE_COLUMNS
+
+
+def _trace_statement(statement: str):
+    """Log an executed statement, leaving out the bound rows of INSERT ... VALUES"""
+    head, values, _ = statement.partition('VALUES')
+    logger.info(f"SQL: {head}VALUES ..." if values else f"SQL: {statement}")
+
 
 class ChangeDetector:
     """Detect changes in Chronos events between syncs"""
     
-    def __init__(self, state_file: str = "data/last_sync.json"):
+    def __init__(self, state_file: str = "data/last_sync.sqlite", debug_sql: bool = False):
         """
         Initialize change detector
         
         Args:
-            state_file: Path to store previous sync state
+            state_file: Path of the SQLite database storing the previous sync state
+            debug_sql: Log every executed statement and the query plans at INFO level
         """
         self.state_file = Path(state_file)
         self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.state_file)
+        self.conn.row_factory = sqlite3.Row
+        if debug_sql:
+            self.conn.set_trace_callback(_trace_statement)
+        for pragma in STATE_PRAGMAS:
+            self.conn.execute(pragma)
         
+        # Only run the DDL when the database predates the current schema
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript(STATE_SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        
+        if debug_sql:
+            self._log_query_plans()
+        
+        # Saved state kept in memory for the lifetime of the detector, loaded on first use
+        self._previous_hashes: Optional[Dict[str, str]] = None
+        self._saved_fingerprint: Optional[str] = None
+        
+    def _log_query_plans(self):
+        """
+        Log the plans of the queries run on every sync, to catch full table scans
+        Their SQL and the schema are fixed once the detector is open, so checking once is enough
+        """
+        queries = {
+            'previous hashes': ("SELECT uid, hash FROM events", ()),
+            'previous events': ('SELECT uid, title, start, "end", description, all_day, code FROM events WHERE uid IN (?)', ('',))
+        }
+        for name, (sql, params) in queries.items():
+            plan = [row['detail'] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            logger.info(f"Query plan for {name}: {'; '.join(plan)}")
+    
     def _event_to_dict(self, event: ChronosEvent) -> Dict:
-        """Convert event to dictionary for comparison"""
+        """Convert event to dictionary for comparison (cached on the event, which is never mutated)"""
+        event_dict = getattr(event, '_dict_cache', None)
+        if event_dict is None:
+            event_dict = {
+                'uid': event.get_unique_id(),
+                'title': event.get_calendar_title(),
+                'start': event.start.isoformat() if event.start else None,
+                'end': event.end.isoformat() if event.end else None,
+                'description': event.get_calendar_description(),
+                'all_day': event.all_day,
+                'code': event.code,
+                # Parsed datetimes, not saved
+                '_start': event.start,
+                '_end': event.end
+            }
+            event_dict['_hash'] = self._event_hash(event_dict)
+            event._dict_cache = event_dict
+        return event_dict
+    
+    @staticmethod
+    def _event_hash(event_dict: Dict) -> str:
+        """Hash of the fields whose change makes an event modified"""
+        return hashlib.blake2b(
+            f"{event_dict['title']}|{event_dict['start']}|{event_dict['end']}|{event_dict['description']}".encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+    
+    def _fingerprint(self, events: List[ChronosEvent]) -> str:
+        """Hash of all events, independent of their order"""
+        digest = hashlib.blake2b(digest_size=16)
+        for uid, event_hash in sorted((d['uid'], d['_hash']) for d in map(self._event_to_dict, events)):
+            digest.update(f"{uid}|{event_hash}\n".encode('utf-8'))
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        """Convert a stored row to the same dict layout as _event_to_dict"""
         return {
-            'uid': event.get_unique_id(),
-            'title': event.get_calendar_title(),
-            'start': event.start.isoformat() if event.start else None,
-            'end': event.end.isoformat() if event.end else None,
-            'description': event.get_calendar_description(),
-            'all_day': event.all_day,
-            'code': event.code
+            'uid': row['uid'],
+            'title': row['title'],
+            'start': row['start'],
+            'end': row['end'],
+            'description': row['description'],
+            'all_day': bool(row['all_day']),
+            'code': row['code'],
+            # Parse the datetimes once instead of on every lookup
+            '_start': datetime.fromisoformat(row['start']) if row['start'] else None,
+            '_end': datetime.fromisoformat(row['end']) if row['end'] else None
         }
     
-    def _load_previous_state(self) -> Dict[str, Dict]:
-        """Load previous sync state from file"""
-        if not self.state_file.exists():
-            logger.info("No previous sync state found")
-            return {}
-        
-        try:
-            with open(self.state_file, 'r') as f:
-                data = json.load(f)
-                return {item['uid']: item for item in data}
-        except Exception as e:
-            logger.error(f"Error loading previous state: {e}")
-            return {}
+    def _load_previous_hashes(self) -> Dict[str, str]:
+        """
+        Load uid -> hash of the previous sync state, read from the database once
+        A read error is raised, an unreadable state must not pass for an empty one
+        """
+        if self._previous_hashes is None:
+            # Build the dict straight from the cursor, one row at a time
+            hashes = dict(self.conn.execute("SELECT uid, hash FROM events"))
+            if not hashes:
+                logger.info("No previous sync state found")
+            self._previous_hashes = hashes
+        return self._previous_hashes
+    
+    def _load_previous_events(self, uids: Iterable[str]) -> Dict[str, Dict]:
+        """Load the full previous state of the given events only"""
+        uids = list(uids)
+        events = {}
+        for i in range(0, len(uids), QUERY_CHUNK_SIZE):
+            chunk = uids[i:i + QUERY_CHUNK_SIZE]
+            rows = self.conn.execute(
+                'SELECT uid, title, start, "end", description, all_day, code FROM events '
+                f"WHERE uid IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            events.update((row['uid'], self._row_to_dict(row)) for row in rows)
+        return events
+    
+    def _stored_fingerprint(self) -> str:
+        """Fingerprint of the events saved by the last sync"""
+        if self._saved_fingerprint is None:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            self._saved_fingerprint = row['value'] if row else None
+        return self._saved_fingerprint
     
-    def _save_current_state(self, events: List[ChronosEvent]):
-        """Save current sync state to file"""
+    def _save_current_state(self, events: List[ChronosEvent]) -> bool:
+        """Save current sync state, upserting events and removing the stale ones; False if it failed"""
         try:
-            event_dicts = [self._event_to_dict(event) for event in events]
-            with open(self.state_file, 'w') as f:
-                json.dump(event_dicts, f, indent=2)
+            fingerprint = self._fingerprint(events)
+            if fingerprint == self._stored_fingerprint():
+                logger.debug("State unchanged, nothing to save")
+                return True
+            
+            event_dicts = {d['uid']: d for d in map(self._event_to_dict, events)}
+            stale_uids = self._load_previous_hashes().keys() - event_dicts.keys()
+            
+            rows = [
+                (d['uid'], d['title'], d['start'], d['end'], d['description'],
+                 int(d['all_day']), d['code'], d['_hash'])
+                for d in event_dicts.values()
+            ]
+            
+            with self.conn:
+                # Multi-row VALUES, fewer statements to step than one per event
+                for i in range(0, len(rows), UPSERT_CHUNK_ROWS):
+                    chunk = rows[i:i + UPSERT_CHUNK_ROWS]
+                    values = ', '.join([f"({', '.join('?' * STATE_COLUMNS)})"] * len(chunk))
+                    self.conn.execute(
+                        UPSERT_ROWS_SQL.format(values=values),
+                        [value for row in chunk for value in row]
+                    )
+                self.conn.executemany("DELETE FROM events WHERE uid = ?", [(uid,) for uid in stale_uids])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)",
+                    (fingerprint,)
+                )
+            self._previous_hashes = {uid: d['_hash'] for uid, d in event_dicts.items()}
+            self._saved_fingerprint = fingerprint
             logger.debug(f"Saved state for {len(event_dicts)} events")
+            
+            # Refresh planner statistics now and then, the connection is long-lived
+            self.conn.execute("PRAGMA optimize")
+            return True
         except Exception as e:
             logger.error(f"Error saving state: {e}")
+            # Read the state back from the database on next use
+            self._previous_hashes = None
+            self._saved_fingerprint = None
+            return False
+    
+    def save_state(self, events: List[ChronosEvent]) -> bool:
+        """Persist events as the reference state, call once the calendar is up to date; False if it failed"""
+        return self._save_current_state(events)
+    
+    def close(self):
+        """Close the state database, letting SQLite refresh its planner statistics first"""
+        try:
+            self.conn.execute("PRAGMA optimize")
+        except Exception as e:
+            logger.warning(f"Could not optimize state database: {e}")
+        self.conn.close()
+    
+    def diff_events(
+        self,
+        current_events: List[ChronosEvent]
+    ) -> Tuple[List[ChronosEvent], List[Dict], List[Tuple[Dict, ChronosEvent]]]:
+        """
+        Compute the raw diff between previous and current sync, without any filtering
+        
+        Args:
+            current_events: List of current events from Chronos
+            
+        Returns:
+            Tuple of (new_events, deleted_events, modified_events)
+            - new_events: List of ChronosEvent objects
+            - deleted_events: List of event dicts
+            - modified_events: List of (old_dict, new_event) tuples
+        """
+        # Nothing to compare if the events are identical to the saved state
+        if self._fingerprint(current_events) == self._stored_fingerprint():
+            logger.debug("Events unchanged since last sync")
+            return [], [], []
+        
+        # Only the hashes of the previous state are needed to find the changes
+        previous_hashes = self._load_previous_hashes()
+        
+        # Convert current events to dicts, keeping the event object alongside
+        current = {}
+        for event in current_events:
+            event_dict = self._event_to_dict(event)
+            current[event_dict['uid']] = (event_dict, event)
+        
+        # Set operations directly on the UID key views
+        current_uids = current.keys()
+        previous_uids = previous_hashes.keys()
+        
+        new_events = [current[uid][1] for uid in current_uids - previous_uids]
+        deleted_uids = previous_uids - current_uids
+        
+        # Modified: same UID but different hash
+        modified_uids = [
+            uid for uid in current_uids & previous_uids
+            if previous_hashes[uid] != current[uid][0]['_hash']
+        ]
+        
+        # Load full rows for the changed events only
+        previous_events = self._load_previous_events([*deleted_uids, *modified_uids])
+        deleted_events = [previous_events[uid] for uid in deleted_uids]
+        modified_events = [(previous_events[uid], current[uid][1]) for uid in modified_uids]
+        
+        return new_events, deleted_events, modified_events
     
     def detect_changes(
         self, 
         current_events: List[ChronosEvent],
-        sync_days_ahead: int
+        sync_days_ahead: int,
+        changes: Tuple = None
     ) -> Tuple[List[ChronosEvent], List[Dict], List[Tuple[Dict, Dict]]]:
         """
-        Detect changes between previous and current sync
+        Detect changes worth notifying between previous and current sync
         
         Args:
             current_events: List of current events from Chronos
             sync_days_ahead: Number of days ahead to sync (for filtering)
+            changes: Raw diff from diff_events, computed if not given
             
         Returns:
             Tuple of (new_events, deleted_events, modified_events)
@@ -87,74 +338,26 @@ class ChangeDetector:
             - deleted_events: List of event dicts
             - modified_events: List of (old_dict, new_dict) tuples
         """
-        # Load previous state
-        previous_state = self._load_previous_state()
-        
-        # Convert current events to dicts
-        current_state = {self._event_to_dict(event)['uid']: self._event_to_dict(event) 
-                        for event in current_events}
-        
-        # Get current UIDs and previous UIDs
-        current_uids = set(current_state.keys())
-        previous_uids = set(previous_state.keys())
-        
-        # Detect changes
-        new_uids = current_uids - previous_uids
-        deleted_uids = previous_uids - current_uids
-        potentially_modified_uids = current_uids & previous_uids
+        if changes is None:
+            changes = self.diff_events(current_events)
+        all_new, all_deleted, all_modified = changes
         
         # Filter out events at the boundary (exactly SYNC_DAYS_AHEAD)
-        boundary_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=sync_days_ahead)
         now = datetime.now()
+        boundary_date = (now + timedelta(days=sync_days_ahead)).date()
         
-        def is_at_boundary(event_dict: Dict) -> bool:
-            """Check if event is at the sync boundary"""
-            if not event_dict.get('start'):
-                return False
-            event_date = datetime.fromisoformat(event_dict['start']).date()
-            return event_date == boundary_date.date()
-        
-        def is_past_event(event_dict: Dict) -> bool:
-            """Check if event is in the past - don't notify about past events"""
-            if not event_dict.get('start'):
-                return False
-            event_datetime = datetime.fromisoformat(event_dict['start'])
-            return event_datetime < now
-        
-        # Find new events (excluding boundary and past events)
-        new_events = []
-        for uid in new_uids:
-            event_dict = current_state[uid]
-            if not is_at_boundary(event_dict) and not is_past_event(event_dict):
-                # Find the original event object
-                event_obj = next((e for e in current_events if self._event_to_dict(e)['uid'] == uid), None)
-                if event_obj:
-                    new_events.append(event_obj)
-        
-        # Find deleted events (excluding boundary and past events)
-        deleted_events = []
-        for uid in deleted_uids:
-            event_dict = previous_state[uid]
-            if not is_at_boundary(event_dict) and not is_past_event(event_dict):
-                deleted_events.append(event_dict)
-        
-        # Find modified events (excluding past events)
-        modified_events = []
-        for uid in potentially_modified_uids:
-            old = previous_state[uid]
-            new = current_state[uid]
-            
-            # Compare relevant fields
-            if (old['title'] != new['title'] or 
-                old['start'] != new['start'] or 
-                old['end'] != new['end'] or
-                old['description'] != new['description']):
-                
-                if not is_at_boundary(new) and not is_past_event(new):
-                    modified_events.append((old, new))
-        
-        # Save current state for next comparison
-        self._save_current_state(current_events)
+        def is_notifiable(event_dict: Dict) -> bool:
+            """Skip events at the sync boundary and past events"""
+            start = event_dict.get('_start')
+            return not start or (start.date() != boundary_date and start >= now)
+        
+        new_events = [event for event in all_new if is_notifiable(self._event_to_dict(event))]
+        deleted_events = [event_dict for event_dict in all_deleted if is_notifiable(event_dict)]
+        modified_events = [
+            (old, new)
+            for old, new in ((old, self._event_to_dict(event)) for old, event in all_modified)
+            if is_notifiable(new)
+        ]
         
         # Log summary
         if new_events or deleted_events or modified_events:
@@ -164,44 +367,67 @@ class ChangeDetector:
         
         return new_events, deleted_events, modified_events
     
-    def format_event_time(self, event_dict: Dict) -> str:
-        """Format event time for display in French"""
+    def describe_changes(
+        self,
+        changes: Tuple[List[ChronosEvent], List[Dict], List[Tuple[Dict, Dict]]]
+    ) -> Tuple[List[Tuple], List[Tuple], List[Tuple]]:
+        """
+        Format the changes from detect_changes for Notifier.send_changes
+        
+        Returns:
+            Tuple of (new_shifts, deleted_shifts, modified_shifts)
+            - new_shifts, deleted_shifts: List of (title, date, time) tuples, time is None for all-day events
+            - modified_shifts: List of (title, old_time, new_time) tuples
+        """
+        new_events, deleted_events, modified_events = changes
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
+        new_shifts = []
+        for event_dict in map(self._event_to_dict, new_events):
+            date_part, time_part = self.format_event_parts(event_dict)
+            new_shifts.append((event_dict['title'], date_part, time_part))
+            if debug:
+                logger.debug("📱 Notifying: New event - %s at %s", event_dict['title'], self.format_event_time(event_dict))
+        
+        deleted_shifts = []
+        for event_dict in deleted_events:
+            date_part, time_part = self.format_event_parts(event_dict)
+            deleted_shifts.append((event_dict['title'], date_part, time_part))
+            if debug:
+                logger.debug("📱 Notifying: Deleted event - %s at %s", event_dict['title'], self.format_event_time(event_dict))
+        
+        modified_shifts = []
+        for old, new in modified_events:
+            modified_shifts.append((new['title'], self.format_event_time(old), self.format_event_time(new)))
+            logger.debug("📱 Notifying: Modified event - %s", new['title'])
+        
+        return new_shifts, deleted_shifts, modified_shifts
+    
+    def format_event_parts(self, event_dict: Dict) -> Tuple[str, Optional[str]]:
+        """Format event date and time range for display in French, time is None for all-day events"""
         try:
-            start = datetime.fromisoformat(event_dict['start'])
-            
-            # French day names mapping (in case locale doesn't work)
-            day_names_fr = {
-                'Monday': 'Lundi',
-                'Tuesday': 'Mardi', 
-                'Wednesday': 'Mercredi',
-                'Thursday': 'Jeudi',
-                'Friday': 'Vendredi',
-                'Saturday': 'Samedi',
-                'Sunday': 'Dimanche'
-            }
-            
-            # French month names
-            month_names_fr = {
-                'January': 'Jan', 'February': 'Fev', 'March': 'Mar',
-                'April': 'Avr', 'May': 'Mai', 'June': 'Juin',
-                'July': 'Juil', 'August': 'Aou', 'September': 'Sep',
-                'October': 'Oct', 'November': 'Nov', 'December': 'Dec'
-            }
+            start = event_dict.get('_start') or datetime.fromisoformat(event_dict['start'])
             
             # Get day name in French
             day_name_en = start.strftime('%A')
-            day_name = day_names_fr.get(day_name_en, day_name_en)
+            day_name = DAY_NAMES_FR.get(day_name_en, day_name_en)
             
             # Get month name in French
             month_name_en = start.strftime('%B')
-            month_name = month_names_fr.get(month_name_en, start.strftime('%b'))
+            month_name = MONTH_NAMES_FR.get(month_name_en, start.strftime('%b'))
             
+            # Format: "Lundi 04 Nov"
+            date_part = f"{day_name} {start.strftime('%d')} {month_name}"
             if event_dict.get('all_day'):
-                # Format: "Lundi 04 Nov"
-                return f"{day_name} {start.strftime('%d')} {month_name}"
-            else:
-                end = datetime.fromisoformat(event_dict['end'])
-                # Format: "Lundi 04 Nov 08:00-17:00"
-                return f"{day_name} {start.strftime('%d')} {month_name} {start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
+                return date_part, None
+            
+            end = event_dict.get('_end') or datetime.fromisoformat(event_dict['end'])
+            # Format: "08:00-17:00"
+            return date_part, f"{start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
         except:
-            return "Date inconnue"
+            return "Date inconnue", None
+    
+    def format_event_time(self, event_dict: Dict) -> str:
+        """Format event time for display in French: Lundi 04 Nov 08:00-17:00"""
+        date_part, time_part = self.format_event_parts(event_dict)
+        return f"{date_part} {time_part}" if time_part else date_part
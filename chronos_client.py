@@ -3,37 +3,155 @@ Chronos API Client for authentication and data fetching
 """
 import requests
 import re
-from typing import Optional, Dict
+import json
+import os
+import base64
+import hashlib
+import html
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Tuple, Callable, Any
+from urllib.parse import parse_qs, urlsplit
 from datetime import datetime
 import logging
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+from http_session import configure_session
 
 logger = logging.getLogger(__name__)
 
+# Re-login this many seconds before the cached token expires
+TOKEN_EXPIRY_SKEW = 60
+
+# Seconds before a Chronos request is abandoned, bounds the fetch_all fan-out
+REQUEST_TIMEOUT = 30
+
+# Action of the Keycloak login form
+LOGIN_FORM_ACTION = re.compile(r'<form[^>]*\baction="([^"]+)"')
+
+# Looks for the bearer token in the page's web storage
+TOKEN_SEARCH_JS = """() => {
+    // Try various possible storage keys
+    const keys = [
+        'token', 'access_token', 'bearer_token', 'accessToken',
+        'auth_token', 'authToken', 'jwt', 'jwtToken'
+    ];
+    
+    // Check localStorage
+    for (const key of keys) {
+        const val = localStorage.getItem(key);
+        if (val) return val;
+    }
+    
+    // Check sessionStorage
+    for (const key of keys) {
+        const val = sessionStorage.getItem(key);
+        if (val) return val;
+    }
+    
+    // Try to find token in any localStorage/sessionStorage value
+    for (let i = 0; i < localStorage.length; i++) {
+        const key = localStorage.key(i);
+        const val = localStorage.getItem(key);
+        if (val && val.includes('eyJ')) {  // JWT tokens start with eyJ
+            try {
+                const obj = JSON.parse(val);
+                if (obj.access_token) return obj.access_token;
+                if (obj.token) return obj.token;
+            } catch(e) {
+                // If value contains eyJ, it might be the token itself
+                if (val.startsWith('eyJ')) return val;
+            }
+        }
+    }
+    
+    return null;
+}"""
+
+# True once a JWT is in the page's web storage
+TOKEN_STORED_JS = """() => [localStorage, sessionStorage].some(storage =>
+    Object.keys(storage).some(key => (storage.getItem(key) || '').includes('eyJ')))"""
+
+# Milliseconds to wait for the application to store its token
+TOKEN_WAIT_TIMEOUT = 5000
+
+# Absence codes requested from Chronos
+ABSENCE_CODES = ('CAP,CPA,CRM,CTJ,DC,DEL,DS,EM,MAL,RCA,RCF,RCH,RCJ,RCN,RHS,AA,AAQ,ANJ,ASA,AT,CA,CAM,CAR,CDC,'
+                 'CEM,CET,CTH,CF,CHS,CM,CMA,CME,COB,CP,CPE,CPP,CSF,CSS,DON,EXC,F,FO,GNR,JNT,MAT,NE,OAJ,OAT,'
+                 'PAT,RCD,RF,RH,RTT')
+
+
+def _write_private_json(path: Path, data: Any):
+    """Write JSON readable by the owner only, the file is never created with wider permissions"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        # The mode only applies to new files, tighten a file left by an older version too
+        os.chmod(path, 0o600)
+        json.dump(data, f)
+
 
 class ChronosClient:
-    def __init__(self, username: str, password: str, base_url: str, auth_url: str):
+    def __init__(self, username: str, password: str, base_url: str, auth_url: str,
+                 state_dir: str = "data"):
         self.username = username
         self.password = password
         self.base_url = base_url
         self.auth_url = auth_url
-        self.session = requests.Session()
+        self.session = configure_session(requests.Session())
         self.bearer_token: Optional[str] = None
         self.cookies: Dict[str, str] = {}
         
-    def authenticate(self) -> bool:
+        # Keycloak refresh grant, captured from the browser's token request
+        self.token_expires_at: Optional[float] = None
+        self.refresh_token: Optional[str] = None
+        self.refresh_expires_at: Optional[float] = None
+        self.token_url: Optional[str] = None
+        self.client_id: Optional[str] = None
+        self.redirect_uri: Optional[str] = None
+        
+        # Persisted authentication, reused across runs while the token is valid
+        state_path = Path(state_dir)
+        state_path.mkdir(parents=True, exist_ok=True)
+        self.auth_file = state_path / "chronos_auth.json"
+        self.browser_state_file = state_path / "pw_state.json"
+        self._auth_lock = threading.Lock()
+        
+        # Last response per item type, revalidated with conditional requests
+        self.response_cache_file = state_path / "response_cache.json"
+        self._response_cache: Optional[Dict[str, Dict]] = None
+        self._cache_lock = threading.Lock()
+        
+    def authenticate(self, use_cache: bool = True) -> bool:
         """
-        Authenticate with Chronos system using headless browser
+        Authenticate with Chronos system
+        Reuses the persisted session while its token has not expired, then tries a
+        direct OIDC login, and only falls back to the headless browser if both fail
         Returns True if authentication successful
         """
+        # Token still valid from a previous sync with this client
+        if use_cache and self._token_valid():
+            return True
+        
+        if use_cache and self._load_cached_auth():
+            return True
+        
+        if self._direct_login():
+            return True
+        
         try:
             logger.info("Starting headless browser authentication...")
             
             with sync_playwright() as p:
                 # Launch headless browser
                 browser = p.chromium.launch(headless=True)
+                
+                # Restore the previous browser session (Keycloak SSO cookies) if any
+                restored = self.browser_state_file.exists()
                 context = browser.new_context(
-                    user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+                    user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+                    storage_state=str(self.browser_state_file) if restored else None
                 )
                 page = context.new_page()
                 
@@ -41,7 +159,7 @@ class ChronosClient:
                 captured_token = {'value': None}
                 
                 def handle_response(response):
-                    """Capture token from OAuth2 token endpoint response"""
+                    """Capture token (and refresh grant) from OAuth2 token endpoint response"""
                     try:
                         if 'token' in response.url and response.status == 200:
                             try:
@@ -49,6 +167,13 @@ class ChronosClient:
                                 if 'access_token' in data:
                                     captured_token['value'] = data['access_token']
                                     logger.info("Captured access_token from network request")
+                                if 'refresh_token' in data:
+                                    form = parse_qs(response.request.post_data or '')
+                                    self.refresh_token = data['refresh_token']
+                                    self.refresh_expires_at = self._expires_at(data.get('refresh_expires_in'))
+                                    self.token_url = response.url.split('?')[0]
+                                    self.client_id = form.get('client_id', [None])[0]
+                                    self.redirect_uri = form.get('redirect_uri', [None])[0]
                             except:
                                 pass
                     except:
@@ -61,25 +186,32 @@ class ChronosClient:
                     logger.info(f"Navigating to {self.base_url}...")
                     page.goto(self.base_url, wait_until='networkidle', timeout=30000)
                     
-                    # Wait for login form to appear (Keycloak)
-                    logger.info("Waiting for login form...")
-                    page.wait_for_selector('input[name="username"], input#username', timeout=10000)
-                    
-                    # Fill in credentials
-                    logger.info("Filling in credentials...")
-                    page.fill('input[name="username"], input#username', self.username)
-                    page.fill('input[name="password"], input#password', self.password)
-                    
-                    # Submit the form
-                    logger.info("Submitting login form...")
-                    page.click('input[type="submit"], button[type="submit"]')
-                    
-                    # Wait for navigation after login (check for successful redirect)
-                    logger.info("Waiting for authentication to complete...")
-                    page.wait_for_url(f"{self.base_url}/**", timeout=15000)
+                    if restored and page.url.startswith(self.base_url):
+                        # Still logged in from the saved browser state
+                        logger.info("Browser session restored, skipping login form")
+                    else:
+                        # Wait for login form to appear (Keycloak)
+                        logger.info("Waiting for login form...")
+                        page.wait_for_selector('input[name="username"], input#username', timeout=10000)
+                        
+                        # Fill in credentials
+                        logger.info("Filling in credentials...")
+                        page.fill('input[name="username"], input#username', self.username)
+                        page.fill('input[name="password"], input#password', self.password)
+                        
+                        # Submit the form
+                        logger.info("Submitting login form...")
+                        page.click('input[type="submit"], button[type="submit"]')
+                        
+                        # Wait for navigation after login (check for successful redirect)
+                        logger.info("Waiting for authentication to complete...")
+                        page.wait_for_url(f"{self.base_url}/**", timeout=15000)
                     
-                    # Wait for the application to load
-                    page.wait_for_timeout(2000)
+                    # Wait for the application to load (an app that keeps polling never goes idle)
+                    try:
+                        page.wait_for_load_state('networkidle', timeout=10000)
+                    except PlaywrightTimeout:
+                        logger.debug("Application still loading, continuing")
                     
                     # Extract cookies from browser
                     browser_cookies = context.cookies()
@@ -98,47 +230,15 @@ class ChronosClient:
                     # Extract bearer token by intercepting the OAuth2 token request
                     # The token is obtained from Keycloak's token endpoint after login
                     try:
-                        # Wait a bit more for token to be stored
-                        page.wait_for_timeout(1000)
+                        # Wait for the token to be stored, unless already captured from the network
+                        if not captured_token['value']:
+                            try:
+                                page.wait_for_function(TOKEN_STORED_JS, timeout=TOKEN_WAIT_TIMEOUT)
+                            except PlaywrightTimeout:
+                                logger.debug("No token appeared in web storage")
                         
                         # Check localStorage for token first
-                        token = page.evaluate("""() => {
-                            // Try various possible storage keys
-                            const keys = [
-                                'token', 'access_token', 'bearer_token', 'accessToken',
-                                'auth_token', 'authToken', 'jwt', 'jwtToken'
-                            ];
-                            
-                            // Check localStorage
-                            for (const key of keys) {
-                                const val = localStorage.getItem(key);
-                                if (val) return val;
-                            }
-                            
-                            // Check sessionStorage
-                            for (const key of keys) {
-                                const val = sessionStorage.getItem(key);
-                                if (val) return val;
-                            }
-                            
-                            // Try to find token in any localStorage/sessionStorage value
-                            for (let i = 0; i < localStorage.length; i++) {
-                                const key = localStorage.key(i);
-                                const val = localStorage.getItem(key);
-                                if (val && val.includes('eyJ')) {  // JWT tokens start with eyJ
-                                    try {
-                                        const obj = JSON.parse(val);
-                                        if (obj.access_token) return obj.access_token;
-                                        if (obj.token) return obj.token;
-                                    } catch(e) {
-                                        // If value contains eyJ, it might be the token itself
-                                        if (val.startsWith('eyJ')) return val;
-                                    }
-                                }
-                            }
-                            
-                            return null;
-                        }""")
+                        token = page.evaluate(TOKEN_SEARCH_JS)
                         
                         if token:
                             self.bearer_token = token
@@ -157,6 +257,10 @@ class ChronosClient:
                     # Verify we have session cookies
                     if self.cookies:
                         logger.info("Authentication successful - cookies extracted")
+                        # Holds the Keycloak SSO cookies and web storage tokens
+                        _write_private_json(self.browser_state_file, context.storage_state())
+                        self.token_expires_at = self._token_expiry(self.bearer_token) if self.bearer_token else None
+                        self._save_cached_auth()
                         return True
                     else:
                         logger.error("No cookies extracted after login")
@@ -175,107 +279,327 @@ class ChronosClient:
             logger.error(f"Authentication error: {e}")
             return False
     
-    def _ensure_authenticated(self) -> bool:
-        """Ensure we have a valid session, re-authenticate if needed"""
-        if not self.cookies:
-            return self.authenticate()
-        return True
+    @staticmethod
+    def _token_expiry(token: str) -> Optional[float]:
+        """Read the `exp` claim (epoch seconds) from a JWT, None if not a JWT"""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
     
-    def fetch_schedule(self, start_date: datetime, end_date: datetime) -> Optional[str]:
-        """
-        Fetch working hours schedule (HORAIRE) from Chronos
-        Returns XML response as string
-        """
-        if not self._ensure_authenticated():
-            logger.error("Cannot fetch schedule - authentication failed")
+    @staticmethod
+    def _expires_at(expires_in) -> Optional[float]:
+        """Convert an OAuth2 `*_expires_in` lifetime to an epoch timestamp"""
+        if not expires_in:
             return None
+        return time.time() + float(expires_in)
+    
+    def _save_cached_auth(self):
+        """Persist token, refresh grant and cookies so the next run can skip the browser login"""
+        if not self.token_expires_at:
+            logger.debug("No token expiry available, not caching authentication")
+            return
         
         try:
-            start_str = start_date.strftime('%d/%m/%Y')
-            end_str = end_date.strftime('%d/%m/%Y')
-            
-            url = f"{self.base_url}/chronos.wsc/asical.html"
-            params = {
-                'infos': 'PLG',
-                'mat': self.username,
-                'usr': self.username,
-                'lstabsprf': '*',
-                'items': 'HORAIRE',
-                'start': start_str,
-                'end': end_str
+            data = {
+                'bearer_token': self.bearer_token,
+                'expires_at': self.token_expires_at,
+                'refresh_token': self.refresh_token,
+                'refresh_expires_at': self.refresh_expires_at,
+                'token_url': self.token_url,
+                'client_id': self.client_id,
+                'redirect_uri': self.redirect_uri,
+                'cookies': [
+                    {
+                        'name': cookie.name,
+                        'value': cookie.value,
+                        'domain': cookie.domain,
+                        'path': cookie.path
+                    }
+                    for cookie in self.session.cookies
+                ]
             }
+            _write_private_json(self.auth_file, data)
+            logger.debug("Saved authentication state")
+        except Exception as e:
+            logger.warning(f"Could not save authentication state: {e}")
+    
+    def _token_valid(self) -> bool:
+        """True if the in-memory token has not expired yet"""
+        return bool(self.cookies) and self.token_expires_at is not None \
+            and self.token_expires_at - TOKEN_EXPIRY_SKEW > time.time()
+    
+    def _load_cached_auth(self) -> bool:
+        """Restore persisted session, refreshing the token if needed; False if unusable"""
+        if not self.auth_file.exists():
+            return False
+        
+        try:
+            with open(self.auth_file, 'r') as f:
+                data = json.load(f)
             
-            headers = {
-                'Accept': 'application/xml, text/xml, */*; q=0.01',
-                'X-Requested-With': 'XMLHttpRequest',
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            }
+            for cookie in data['cookies']:
+                self.session.cookies.set(
+                    cookie['name'],
+                    cookie['value'],
+                    domain=cookie['domain'],
+                    path=cookie['path']
+                )
+                self.cookies[cookie['name']] = cookie['value']
+            self.bearer_token = data['bearer_token']
+            self.token_expires_at = data['expires_at']
+            self.refresh_token = data.get('refresh_token')
+            self.refresh_expires_at = data.get('refresh_expires_at')
+            self.token_url = data.get('token_url')
+            self.client_id = data.get('client_id')
+            self.redirect_uri = data.get('redirect_uri')
             
-            # Add bearer token if available
-            if self.bearer_token:
-                headers['Authorization'] = f'Bearer {self.bearer_token}'
+            if self.token_expires_at - TOKEN_EXPIRY_SKEW <= time.time():
+                logger.info("Cached token expired")
+                return self._refresh()
             
-            response = self.session.get(url, params=params, headers=headers, cookies=self.cookies)
+            logger.info("Reusing cached authentication")
+            return bool(self.cookies)
+        except Exception as e:
+            logger.warning(f"Could not load authentication state: {e}")
+            return False
+    
+    def _refresh(self) -> bool:
+        """Get a new access token with the Keycloak refresh_token grant"""
+        if not (self.refresh_token and self.token_url and self.client_id):
+            return False
+        if self.refresh_expires_at and self.refresh_expires_at - TOKEN_EXPIRY_SKEW <= time.time():
+            logger.info("Refresh token expired")
+            return False
+        
+        try:
+            response = self.session.post(self.token_url, data={
+                'grant_type': 'refresh_token',
+                'refresh_token': self.refresh_token,
+                'client_id': self.client_id
+            }, timeout=10)
+            if response.status_code in (400, 401):
+                logger.info("Refresh token rejected")
+                return False
             response.raise_for_status()
             
-            logger.info(f"Fetched schedule from {start_str} to {end_str}")
-            return response.text
-            
+            self._apply_token_response(response.json())
+            logger.info("Access token refreshed")
+            self._save_cached_auth()
+            return True
         except Exception as e:
-            logger.error(f"Error fetching schedule: {e}")
-            return None
+            logger.warning(f"Could not refresh token: {e}")
+            return False
     
-    def fetch_absences(self, start_date: datetime, end_date: datetime) -> Optional[str]:
+    def _apply_token_response(self, data: Dict):
+        """Store the tokens of a Keycloak token endpoint response"""
+        self.bearer_token = data['access_token']
+        self.token_expires_at = self._token_expiry(self.bearer_token) or self._expires_at(data.get('expires_in'))
+        self.refresh_token = data.get('refresh_token', self.refresh_token)
+        if data.get('refresh_expires_in'):
+            self.refresh_expires_at = self._expires_at(data['refresh_expires_in'])
+    
+    def _direct_login(self) -> bool:
         """
-        Fetch absences (RTT, CA, etc.) from Chronos
-        Returns XML response as string
+        Log in against Keycloak with plain HTTP requests, without a browser
+        Needs the client settings captured by a previous browser login
         """
-        if not self._ensure_authenticated():
-            logger.error("Cannot fetch absences - authentication failed")
-            return None
+        if not (self.token_url and self.client_id):
+            return False
         
         try:
-            start_str = start_date.strftime('%d/%m/%Y')
-            end_str = end_date.strftime('%d/%m/%Y')
-            
-            url = f"{self.base_url}/chronos.wsc/asical.html"
-            params = {
-                'infos': 'COD',
-                'mat': self.username,
-                'usr': self.username,
-                'lstabsprf': 'CAP,CPA,CRM,CTJ,DC,DEL,DS,EM,MAL,RCA,RCF,RCH,RCJ,RCN,RHS,AA,AAQ,ANJ,ASA,AT,CA,CAM,CAR,CDC,CEM,CET,CTH,CF,CHS,CM,CMA,CME,COB,CP,CPE,CPP,CSF,CSS,DON,EXC,F,FO,GNR,JNT,MAT,NE,OAJ,OAT,PAT,RCD,RF,RH,RTT',
-                'items': 'ABSENCEJ',
-                'start': start_str,
-                'end': end_str
-            }
-            
-            headers = {
-                'Accept': 'application/xml, text/xml, */*; q=0.01',
-                'X-Requested-With': 'XMLHttpRequest',
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            }
-            
-            # Add bearer token if available
-            if self.bearer_token:
-                headers['Authorization'] = f'Bearer {self.bearer_token}'
+            logger.info("Trying direct OIDC login...")
+            if not (self._password_grant() or self._authorization_code_login()):
+                logger.info("Direct login not possible, falling back to browser")
+                return False
             
-            response = self.session.get(url, params=params, headers=headers, cookies=self.cookies)
-            response.raise_for_status()
-            
-            logger.info(f"Fetched absences from {start_str} to {end_str}")
-            return response.text
+            # Visit the application so it sets its own session cookies
+            self.session.get(self.base_url, timeout=30)
+            self.cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
             
+            logger.info("Direct login successful")
+            self._save_cached_auth()
+            return True
         except Exception as e:
-            logger.error(f"Error fetching absences: {e}")
-            return None
+            logger.warning(f"Direct login failed: {e}")
+            return False
     
-    def fetch_activities(self, start_date: datetime, end_date: datetime) -> Optional[str]:
+    def _password_grant(self) -> bool:
+        """Resource Owner Password Credentials grant, only if enabled on the client"""
+        response = self.session.post(self.token_url, data={
+            'grant_type': 'password',
+            'client_id': self.client_id,
+            'username': self.username,
+            'password': self.password,
+            'scope': 'openid'
+        }, timeout=10)
+        if response.status_code != 200:
+            logger.debug(f"Password grant refused ({response.status_code})")
+            return False
+        
+        self._apply_token_response(response.json())
+        return True
+    
+    def _authorization_code_login(self) -> bool:
+        """Authorization code flow with PKCE, submitting the Keycloak login form directly"""
+        if not self.redirect_uri:
+            return False
+        
+        code_verifier = secrets.token_urlsafe(64)
+        code_challenge = base64.urlsafe_b64encode(
+            hashlib.sha256(code_verifier.encode('ascii')).digest()
+        ).decode('ascii').rstrip('=')
+        
+        # Keycloak serves the auth endpoint next to the token endpoint
+        auth_endpoint = self.token_url.rsplit('/', 1)[0] + '/auth'
+        login_page = self.session.get(auth_endpoint, params={
+            'client_id': self.client_id,
+            'redirect_uri': self.redirect_uri,
+            'response_type': 'code',
+            'response_mode': 'query',
+            'scope': 'openid',
+            'state': secrets.token_urlsafe(16),
+            'code_challenge': code_challenge,
+            'code_challenge_method': 'S256'
+        }, timeout=30)
+        login_page.raise_for_status()
+        
+        match = LOGIN_FORM_ACTION.search(login_page.text)
+        if not match:
+            logger.debug("Keycloak login form not found")
+            return False
+        
+        response = self.session.post(html.unescape(match.group(1)), data={
+            'username': self.username,
+            'password': self.password,
+            'credentialId': ''
+        }, allow_redirects=False, timeout=30)
+        
+        # Successful login redirects back to the application with the code
+        location = urlsplit(response.headers.get('Location', ''))
+        code = (parse_qs(location.query).get('code') or parse_qs(location.fragment).get('code') or [None])[0]
+        if not code:
+            logger.debug(f"No authorization code after login form ({response.status_code})")
+            return False
+        
+        token_response = self.session.post(self.token_url, data={
+            'grant_type': 'authorization_code',
+            'client_id': self.client_id,
+            'code': code,
+            'redirect_uri': self.redirect_uri,
+            'code_verifier': code_verifier
+        }, timeout=10)
+        token_response.raise_for_status()
+        
+        self._apply_token_response(token_response.json())
+        return True
+    
+    def _reauthenticate(self, rejected_token: Optional[str]) -> bool:
+        """Force a fresh login once, concurrent callers wait for the same login"""
+        with self._auth_lock:
+            if self.bearer_token != rejected_token:
+                # Another thread already logged in again
+                return True
+            logger.info("Session rejected by Chronos, logging in again")
+            if self._refresh():
+                return True
+            self.cookies = {}
+            self.session.cookies.clear()
+            return self.authenticate(use_cache=False)
+    
+    def _get(self, url: str, params: Dict, headers: Dict) -> requests.Response:
+        """GET an authenticated URL, logging in again if the saved session was rejected"""
+        token = self.bearer_token
+        response = self.session.get(url, params=params, headers=headers, cookies=self.cookies,
+                                    timeout=REQUEST_TIMEOUT)
+        
+        # An expired session gets a 401/403 or is redirected to the Keycloak login
+        if (response.status_code in (401, 403) or response.url.startswith(self.auth_url)) \
+                and self._reauthenticate(token):
+            if self.bearer_token:
+                headers = dict(headers, Authorization=f'Bearer {self.bearer_token}')
+            response = self.session.get(url, params=params, headers=headers, cookies=self.cookies,
+                                        timeout=REQUEST_TIMEOUT)
+        
+        response.raise_for_status()
+        return response
+    
+    def _ensure_authenticated(self) -> bool:
+        """Ensure we have a valid session, re-authenticate if needed"""
+        if not self.cookies:
+            return self.authenticate()
+        return True
+    
+    def fetch_all(self, start_date: datetime, end_date: datetime,
+                  parse: Optional[Callable[[Optional[str]], Any]] = None) -> Tuple[Any, Any, Any]:
         """
-        Fetch activities from Chronos
+        Fetch schedule, absences and activities concurrently
+        Takes about as long as the slowest of the three requests
+        If given, parse is applied to each response in its worker, overlapping
+        parsing with the requests still in flight
+        Returns (schedule_xml, absences_xml, activities_xml), or their parsed values
+        """
+        def fetch(fetch_method):
+            xml = fetch_method(start_date, end_date)
+            return parse(xml) if parse else xml
+        
+        # Authenticate once up front so the workers don't each start a login
+        if not self._ensure_authenticated():
+            logger.error("Cannot fetch data - authentication failed")
+            return tuple(parse(None) if parse else None for _ in range(3))
+        
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            schedule = executor.submit(fetch, self.fetch_schedule)
+            absences = executor.submit(fetch, self.fetch_absences)
+            activities = executor.submit(fetch, self.fetch_activities)
+            return schedule.result(), absences.result(), activities.result()
+    
+    def _load_response_cache(self) -> Dict[str, Dict]:
+        """Load the last response per item type, used for conditional requests"""
+        if self._response_cache is None:
+            self._response_cache = {}
+            if self.response_cache_file.exists():
+                try:
+                    with open(self.response_cache_file, 'r') as f:
+                        self._response_cache = json.load(f)
+                except Exception as e:
+                    logger.warning(f"Could not load response cache: {e}")
+        return self._response_cache
+    
+    def _store_response(self, items: str, key: str, response: requests.Response):
+        """Remember a response body with its validators (ETag / Last-Modified)"""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._cache_lock:
+            cache = self._load_response_cache()
+            if not (etag or last_modified):
+                # Nothing to revalidate with, don't keep the body around
+                if cache.pop(items, None) is None:
+                    return
+            else:
+                cache[items] = {
+                    'key': key,
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'body': response.text
+                }
+            try:
+                # Raw schedule and absence data, private like the login state
+                _write_private_json(self.response_cache_file, cache)
+            except Exception as e:
+                logger.warning(f"Could not save response cache: {e}")
+    
+    def _fetch(self, label: str, infos: str, lstabsprf: str, items: str,
+               start_date: datetime, end_date: datetime) -> Optional[str]:
+        """
+        Fetch one item type from the Chronos calendar endpoint
+        Revalidates the previous response (304 Not Modified) instead of downloading it again
         Returns XML response as string
         """
         if not self._ensure_authenticated():
-            logger.error("Cannot fetch activities - authentication failed")
+            logger.error(f"Cannot fetch {label} - authentication failed")
             return None
         
         try:
@@ -284,11 +608,11 @@ class ChronosClient:
             
             url = f"{self.base_url}/chronos.wsc/asical.html"
             params = {
-                'infos': 'COD',
+                'infos': infos,
                 'mat': self.username,
                 'usr': self.username,
-                'lstabsprf': '*',
-                'items': 'ACTIVITES',
+                'lstabsprf': lstabsprf,
+                'items': items,
                 'start': start_str,
                 'end': end_str
             }
@@ -303,12 +627,49 @@ class ChronosClient:
             if self.bearer_token:
                 headers['Authorization'] = f'Bearer {self.bearer_token}'
             
-            response = self.session.get(url, params=params, headers=headers, cookies=self.cookies)
-            response.raise_for_status()
+            # Add validators of the cached response for the same request
+            key = f"{self.username}|{start_str}|{end_str}"
+            with self._cache_lock:
+                cached = self._load_response_cache().get(items)
+            if cached and cached['key'] == key:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+            else:
+                cached = None
+            
+            response = self._get(url, params=params, headers=headers)
+            
+            if response.status_code == 304 and cached:
+                logger.info(f"Fetched {label} from {start_str} to {end_str} (not modified)")
+                return cached['body']
             
-            logger.info(f"Fetched activities from {start_str} to {end_str}")
+            self._store_response(items, key, response)
+            logger.info(f"Fetched {label} from {start_str} to {end_str}")
             return response.text
             
         except Exception as e:
-            logger.error(f"Error fetching activities: {e}")
+            logger.error(f"Error fetching {label}: {e}")
             return None
+    
+    def fetch_schedule(self, start_date: datetime, end_date: datetime) -> Optional[str]:
+        """
+        Fetch working hours schedule (HORAIRE) from Chronos
+        Returns XML response as string
+        """
+        return self._fetch('schedule', 'PLG', '*', 'HORAIRE', start_date, end_date)
+    
+    def fetch_absences(self, start_date: datetime, end_date: datetime) -> Optional[str]:
+        """
+        Fetch absences (RTT, CA, etc.) from Chronos
+        Returns XML response as string
+        """
+        return self._fetch('absences', 'COD', ABSENCE_CODES, 'ABSENCEJ', start_date, end_date)
+    
+    def fetch_activities(self, start_date: datetime, end_date: datetime) -> Optional[str]:
+        """
+        Fetch activities from Chronos
+        Returns XML response as string
+        """
+        return self._fetch('activities', 'COD', '*', 'ACTIVITES', start_date, end_date)
@@ -1,17 +1,87 @@
 """
 Parser for Chronos XML responses
 """
-import xml.etree.ElementTree as ET
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
+from functools import lru_cache
+import html
 import logging
+import re
+
+# libxml2 parser when available, same ElementTree API otherwise
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
 
 logger = logging.getLogger(__name__)
 
+# Characters fed to the XML parser at a time, bounds the live element tree
+PARSE_CHUNK_SIZE = 64 * 1024
+
+# Line breaks in Chronos descriptions
+BR_TAG = re.compile(r'<br\s*/?>', re.IGNORECASE)
+
+# Unique ID prefix and distinguishing attribute per event type
+UID_FIELDS = {
+    'HORAIRE': ('HORAIRE', 'planning'),
+    'ABSENCEJ': ('ABSENCE', 'code'),
+    'ACTIVITES': ('ACTIVITY', 'lib')
+}
+
+
+def _event_row_parser():
+    """Pull parser reporting the end of each eventRow"""
+    if HAS_LXML:
+        # Filter on the tag and skip blank text in C
+        return ET.XMLPullParser(
+            events=('end',), tag='eventRow',
+            remove_blank_text=True, collect_ids=False, huge_tree=False
+        )
+    return ET.XMLPullParser(events=('end',))
+
+
+@lru_cache(maxsize=4096)
+def _parse_chronos_date(date_str: str) -> Optional[datetime]:
+    """Parse date string from Chronos format, cached as dates repeat across events"""
+    # Fast path for the fixed layouts Chronos emits
+    try:
+        if len(date_str) == 19 and date_str[10] == 'T':
+            # 2025-10-24T07:15:00
+            return datetime(
+                int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+                int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19])
+            )
+        if len(date_str) == 10:
+            # 2025-10-24
+            return datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+    except ValueError:
+        pass
+    
+    try:
+        # Try ISO format: 2025-10-24T07:15:00
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    except:
+        try:
+            # Try date only: 2025-10-24
+            return datetime.strptime(date_str, '%Y-%m-%d')
+        except:
+            logger.warning(f"Could not parse date: {date_str}")
+            return None
+
 
 class ChronosEvent:
     """Represents a single event from Chronos"""
     
+    __slots__ = (
+        'event_id', 'title', 'all_day', 'start', 'end', 'description', 'code',
+        'lib', 'planning', 'duration', 'symbol', 'abbreviation',
+        # Comparison dict cached by ChangeDetector
+        '_dict_cache'
+    )
+    
     def __init__(self, event_data: Dict[str, Any]):
         self.event_id = event_data.get('p_id', '')
         self.title = self._fix_encoding(event_data.get('p_title', ''))
@@ -41,16 +111,7 @@ class ChronosEvent:
         """Parse date string from Chronos format"""
         if not date_str:
             return None
-        try:
-            # Try ISO format: 2025-10-24T07:15:00
-            return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        except:
-            try:
-                # Try date only: 2025-10-24
-                return datetime.strptime(date_str, '%Y-%m-%d')
-            except:
-                logger.warning(f"Could not parse date: {date_str}")
-                return None
+        return _parse_chronos_date(date_str)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert event to dictionary"""
@@ -118,8 +179,8 @@ class ChronosEvent:
         if self.duration:
             parts.append(f"Duration: {self.duration}")
         if self.description:
-            # Remove HTML tags from description
-            clean_desc = self.description.replace('<br>', '\n').replace('&gt;', '>').replace('&lt;', '<')
+            # Turn line breaks into newlines, then decode HTML entities
+            clean_desc = html.unescape(BR_TAG.sub('\n', self.description))
             parts.append(clean_desc)
         return '\n'.join(parts)
     
@@ -127,13 +188,8 @@ class ChronosEvent:
         """Generate unique identifier for this event"""
         # Combine event type, date, and planning/code to create unique ID
         start_str = self.start.isoformat() if self.start else 'no-date'
-        if self.event_id == 'HORAIRE':
-            return f"HORAIRE-{start_str}-{self.planning}"
-        elif self.event_id == 'ABSENCEJ':
-            return f"ABSENCE-{start_str}-{self.code}"
-        elif self.event_id == 'ACTIVITES':
-            return f"ACTIVITY-{start_str}-{self.lib}"
-        return f"{self.event_id}-{start_str}-{self.title}"
+        prefix, field = UID_FIELDS.get(self.event_id, (self.event_id, 'title'))
+        return f"{prefix}-{start_str}-{getattr(self, field)}"
 
 
 class ChronosParser:
@@ -149,17 +205,25 @@ class ChronosParser:
             return []
         
         try:
-            root = ET.fromstring(xml_string)
+            # Incremental parse, each eventRow is cleared once converted
+            parser = _event_row_parser()
             events = []
+            debug = logger.isEnabledFor(logging.DEBUG)
             
-            for event_row in root.findall('.//eventRow'):
-                event_data = {}
-                for child in event_row:
-                    event_data[child.tag] = child.text or ''
-                
-                event = ChronosEvent(event_data)
-                events.append(event)
-                logger.debug(f"Parsed event: {event.get_calendar_title()} on {event.start}")
+            for i in range(0, len(xml_string), PARSE_CHUNK_SIZE):
+                parser.feed(xml_string[i:i + PARSE_CHUNK_SIZE])
+                for _, element in parser.read_events():
+                    if element.tag != 'eventRow':
+                        continue
+                    
+                    event_data = {child.tag: child.text or '' for child in element}
+                    element.clear()
+                    
+                    event = ChronosEvent(event_data)
+                    events.append(event)
+                    if debug:
+                        logger.debug("Parsed event: %s on %s", event.get_calendar_title(), event.start)
+            parser.close()
             
             logger.info(f"Parsed {len(events)} events from XML")
             return events
@@ -181,18 +245,16 @@ class ChronosParser:
         logger.info(f"Merging events: {len(schedule)} schedule, {len(absences)} absences, {len(activities)} activities")
         
         # Create a date map for absences (highest priority)
-        absence_dates = {event.start.date(): event for event in absences if event.start}
-        logger.debug(f"Absence dates: {list(absence_dates.keys())}")
+        absence_dates = {event.start.date() for event in absences if event.start}
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Absence dates: %s", sorted(absence_dates))
         
         # Filter out schedule items on dates with absences
-        filtered_schedule = []
-        removed_count = 0
-        for event in schedule:
-            if not event.start or event.start.date() not in absence_dates:
-                filtered_schedule.append(event)
-            else:
-                removed_count += 1
-                logger.debug(f"Removed schedule event on {event.start.date()} due to absence")
+        filtered_schedule = [
+            event for event in schedule
+            if not event.start or event.start.date() not in absence_dates
+        ]
+        removed_count = len(schedule) - len(filtered_schedule)
         
         if removed_count > 0:
             logger.info(f"Removed {removed_count} schedule events due to absences")
@@ -207,7 +269,8 @@ class ChronosParser:
                    f"{len(filtered_schedule)} schedule items, {len(all_events)} total")
         
         # Log summary of merged events
-        for i, event in enumerate(all_events, 1):
-            logger.debug(f"  {i}. {event.get_calendar_title()} - {event.start} to {event.end}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, event in enumerate(all_events, 1):
+                logger.debug("  %d. %s - %s to %s", i, event.get_calendar_title(), event.start, event.end)
         
         return all_events
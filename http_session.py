@@ -0,0 +1,25 @@
+"""
+Shared HTTP session setup (connection pooling, keep-alive and retries)
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 16
+
+
+def configure_session(session: requests.Session) -> requests.Session:
+    """Mount a keep-alive connection pool with retries on transient errors"""
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE,
+        pool_maxsize=POOL_SIZE,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504]
+        )
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
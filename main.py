@@ -1,13 +1,18 @@
 """
 Main application with scheduler and Flask API
 """
+import hashlib
+import hmac
+import json
 import logging
+import signal
 import threading
 import time
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
-from flask import Flask, jsonify
+from types import MappingProxyType
+from flask import Flask, Response, request
 from dotenv import load_dotenv
 from chronos_client import ChronosClient
 from chronos_parser import ChronosParser
@@ -15,6 +20,12 @@ from calendar_sync import CalendarSync
 from notifier import Notifier
 from change_detector import ChangeDetector
 
+# Production WSGI server, the Flask development server is used without it
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -25,13 +36,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global state for health endpoint
-sync_state = {
+# Global state for health endpoint, a read-only snapshot replaced as a whole on updates
+sync_state = MappingProxyType({
     'last_run': None,
     'last_status': 'never_run',
     'last_error': None,
     'events_synced': 0
-}
+})
+sync_state_lock = threading.Lock()
+
+
+def serialize_health(state):
+    """Serialize the /health response body for a sync state snapshot"""
+    return json.dumps({
+        'status': state['last_status'],
+        'last_run': state['last_run'],
+        'last_error': state['last_error'],
+        'events_synced': state['events_synced']
+    }).encode('utf-8')
+
+
+# Serialized /health body, published together with sync_state
+health_body = serialize_health(sync_state)
+
+# Set to wake the scheduler before its next run, for on-demand syncs and shutdown
+sync_trigger = threading.Event()
+stop_scheduler = threading.Event()
+
+# Seconds to wait on exit for the scheduler to close its clients, below docker stop's 10s
+SHUTDOWN_TIMEOUT = 5
 
 # Flask app
 app = Flask(__name__)
@@ -71,7 +104,10 @@ def load_config():
         },
         'app': {
             'port': int(get_env('APP_PORT', '8000', required=False)),
-            'host': get_env('APP_HOST', '0.0.0.0', required=False)
+            'host': get_env('APP_HOST', '0.0.0.0', required=False),
+            'threads': int(get_env('WEB_THREADS', '4', required=False)),
+            'sql_debug': get_env('CHRONOS_SQL_DEBUG', '', required=False).lower() in ('1', 'true'),
+            'sync_token': get_env('SYNC_TRIGGER_TOKEN', '', required=False)
         }
     }
     
@@ -79,24 +115,62 @@ def load_config():
     return config
 
 
-def perform_sync(config, is_first_run=False):
-    """Perform a single sync operation"""
-    global sync_state
-    
-    try:
-        logger.info("=" * 50)
-        logger.info("Starting sync operation")
-        sync_state['last_run'] = datetime.now().isoformat()
-        
-        # Initialize Chronos client
-        chronos = ChronosClient(
+def update_sync_state(**fields):
+    """Publish a new sync state snapshot and its health response, readers never see a partial update"""
+    global sync_state, health_body
+    with sync_state_lock:
+        state = MappingProxyType({**sync_state, **fields})
+        # Rebinding the globals is atomic, /health reads them without locking
+        health_body = serialize_health(state)
+        sync_state = state
+
+
+def create_clients(config):
+    """
+    Create the Chronos, calendar and notification clients
+    They live as long as the scheduler, so connections and tokens carry over between syncs
+    """
+    clients = {
+        'chronos': ChronosClient(
             username=config['chronos']['username'],
             password=config['chronos']['password'],
             base_url=config['chronos']['base_url'],
             auth_url=config['chronos']['auth_url']
+        ),
+        'calendar': CalendarSync(
+            url=config['icalendar']['url'],
+            username=config['icalendar']['username'],
+            password=config['icalendar']['password'],
+            calendar_name=config['icalendar']['calendar_name']
+        ),
+        'change_detector': ChangeDetector(debug_sql=config['app']['sql_debug']),
+        'notifier': None,
+        # Digests of the Chronos responses of the last successful sync, with their events
+        'feeds': {},
+        # Reconcile the whole calendar until a full sync has succeeded
+        'needs_full_sync': True
+    }
+    
+    if config['notifications']['enabled'] and config['notifications']['ntfy_topic']:
+        clients['notifier'] = Notifier(
+            topic=config['notifications']['ntfy_topic'],
+            server=config['notifications']['ntfy_server'],
+            enabled=True
         )
+        logger.info("Notifications enabled")
+    
+    return clients
+
+
+def perform_sync(config, clients, is_first_run=False):
+    """Perform a single sync operation"""
+    try:
+        logger.info("Starting sync operation")
+        update_sync_state(last_run=datetime.now().isoformat())
+        
+        chronos = clients['chronos']
         
-        # Authenticate
+        # Authenticate, the token is kept in memory between syncs
         logger.info("Authenticating with Chronos...")
         if not chronos.authenticate():
             raise Exception("Authentication failed")
@@ -107,119 +181,109 @@ def perform_sync(config, is_first_run=False):
         
         logger.info(f"Fetching data from {start_date.date()} to {end_date.date()}")
         
-        # Fetch all data types
-        schedule_xml = chronos.fetch_schedule(start_date, end_date)
-        absences_xml = chronos.fetch_absences(start_date, end_date)
-        activities_xml = chronos.fetch_activities(start_date, end_date)
-        
-        # Parse XML responses
+        # Fetch all data types, each response is parsed as soon as it arrives
         parser = ChronosParser()
-        schedule_events = parser.parse_xml(schedule_xml) if schedule_xml else []
-        absence_events = parser.parse_xml(absences_xml) if absences_xml else []
-        activity_events = parser.parse_xml(activities_xml) if activities_xml else []
+        previous_feeds = clients['feeds']
+        
+        def parse_feed(xml):
+            """Parse a response, reusing the last sync's events if it is unchanged"""
+            if not xml:
+                return None, []
+            digest = hashlib.blake2b(xml.encode('utf-8'), digest_size=16).digest()
+            events = previous_feeds.get(digest)
+            if events is None:
+                events = parser.parse_xml(xml)
+            return digest, events
+        
+        feeds = chronos.fetch_all(start_date, end_date, parse=parse_feed)
+        digests = [digest for digest, _ in feeds]
+        
+        # A failed fetch must not look like a feed without events, that would delete them
+        if None in digests:
+            raise Exception("Failed to fetch Chronos data")
+        
+        # Identical responses give the same events, which the calendar already has
+        if not clients['needs_full_sync'] and previous_feeds.keys() == set(digests):
+            update_sync_state(last_status='success', last_error=None)
+            logger.info("Chronos data unchanged since last sync, nothing to do")
+            return
+        clients['feeds'] = {}
+        
+        (_, schedule_events), (_, absence_events), (_, activity_events) = feeds
         
         # Merge events (absences take priority over work schedule)
         all_events = parser.merge_events(schedule_events, absence_events, activity_events)
         
         logger.info(f"Total events to sync: {len(all_events)}")
         
-        # Initialize notifier if enabled
-        notifier = None
-        if config['notifications']['enabled'] and config['notifications']['ntfy_topic']:
-            notifier = Notifier(
-                topic=config['notifications']['ntfy_topic'],
-                server=config['notifications']['ntfy_server'],
-                enabled=True
-            )
-            logger.info("Notifications enabled")
+        # Send test notification on first run only
+        notifier = clients['notifier']
+        if notifier and is_first_run:
+            notifier.send_test()
+        
+        # Compare with the previous sync state
+        change_detector = clients['change_detector']
+        changes = change_detector.diff_events(all_events)
+        
+        # Full reconcile on startup and after a failed one, then only the diff
+        calendar_changes = None
+        if not clients['needs_full_sync']:
+            new_events, deleted_events, modified_events = changes
+            # Past events that scrolled out of the sync window stay in the calendar
+            deleted_events = [
+                d for d in deleted_events
+                if d['_start'] and d['_start'].date() >= start_date.date()
+            ]
+            calendar_changes = (new_events, deleted_events, modified_events)
+        
+        if calendar_changes is not None and not any(calendar_changes):
+            # Nothing to send, don't go to CalDAV at all
+            logger.info("Calendar already up to date")
+        else:
+            # Connect to calendar, once for the lifetime of the client
+            cal_sync = clients['calendar']
+            if cal_sync.calendar is None:
+                logger.info("Connecting to iCloud calendar...")
+                if not cal_sync.connect():
+                    raise Exception("Failed to connect to calendar")
             
-            # Send test notification on first run only
-            if is_first_run:
-                notifier.send_test()
+            logger.info("Syncing events to calendar...")
+            if calendar_changes is None:
+                synced = cal_sync.sync_events(all_events)
+            else:
+                synced = cal_sync.sync_changes(*calendar_changes)
+            if not synced:
+                # Look the calendar up again on the next sync in case it changed
+                cal_sync.calendar = None
+                raise Exception("Failed to sync events")
+            clients['needs_full_sync'] = False
         
-        # Detect changes (only if not first run)
+        # Only persist the state once the calendar matches it
+        # Feeds are only kept once it is saved, otherwise the next sync runs the diff again
+        if not change_detector.save_state(all_events):
+            raise Exception("Failed to save sync state")
+        clients['feeds'] = dict(feeds)
+        
+        # Notify about changes (only if not first run), once they are in the calendar
+        # A failed sync keeps the old state, its changes are notified when they get applied
         if not is_first_run and notifier:
-            change_detector = ChangeDetector()
-            new_events, deleted_events, modified_events = change_detector.detect_changes(
+            notified_changes = change_detector.detect_changes(
                 all_events,
-                config['sync']['days_ahead']
+                config['sync']['days_ahead'],
+                changes=changes
             )
             
-            # Send notifications for changes
-            for event in new_events:
-                title = event.get_calendar_title()
-                time_str = change_detector.format_event_time(change_detector._event_to_dict(event))
-                logger.info(f"📱 Notifying: New event - {title} at {time_str}")
-                
-                if event.all_day:
-                    notifier.send_new_shift(title, time_str)
-                else:
-                    # Extract time portion
-                    parts = time_str.split()
-                    date_part = ' '.join(parts[:3]) if len(parts) >= 3 else time_str
-                    time_part = parts[-1] if len(parts) >= 4 else None
-                    notifier.send_new_shift(title, date_part, time_part)
-            
-            for event_dict in deleted_events:
-                title = event_dict['title']
-                time_str = change_detector.format_event_time(event_dict)
-                logger.info(f"📱 Notifying: Deleted event - {title} at {time_str}")
-                
-                if event_dict['all_day']:
-                    notifier.send_deleted_shift(title, time_str)
-                else:
-                    parts = time_str.split()
-                    date_part = ' '.join(parts[:3]) if len(parts) >= 3 else time_str
-                    time_part = parts[-1] if len(parts) >= 4 else None
-                    notifier.send_deleted_shift(title, date_part, time_part)
-            
-            for old, new in modified_events:
-                title = new['title']
-                old_time = change_detector.format_event_time(old)
-                new_time = change_detector.format_event_time(new)
-                logger.info(f"📱 Notifying: Modified event - {title}")
-                notifier.send_modified_shift(title, old_time, new_time)
-        
-        elif not is_first_run:
-            # Still track changes even without notifications
-            change_detector = ChangeDetector()
-            change_detector.detect_changes(all_events, config['sync']['days_ahead'])
-        else:
-            # First run - just save state
-            change_detector = ChangeDetector()
-            change_detector._save_current_state(all_events)
-        
-        # Initialize calendar sync
-        cal_sync = CalendarSync(
-            url=config['icalendar']['url'],
-            username=config['icalendar']['username'],
-            password=config['icalendar']['password'],
-            calendar_name=config['icalendar']['calendar_name']
-        )
-        
-        # Connect to calendar
-        logger.info("Connecting to iCloud calendar...")
-        if not cal_sync.connect():
-            raise Exception("Failed to connect to calendar")
-        
-        # Sync events
-        logger.info("Syncing events to calendar...")
-        if not cal_sync.sync_events(all_events):
-            raise Exception("Failed to sync events")
+            # Many changes at once are sent as a single summary
+            notifier.send_changes(*change_detector.describe_changes(notified_changes))
         
         # Update state
-        sync_state['last_status'] = 'success'
-        sync_state['last_error'] = None
-        sync_state['events_synced'] = len(all_events)
+        update_sync_state(last_status='success', last_error=None, events_synced=len(all_events))
         logger.info(f"Sync completed successfully - {len(all_events)} events synced")
-        logger.info("=" * 50)
         
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Sync failed: {error_msg}")
-        sync_state['last_status'] = 'failed'
-        sync_state['last_error'] = error_msg
-        logger.info("=" * 50)
+        update_sync_state(last_status='failed', last_error=error_msg)
 
 
 def sync_scheduler(config):
@@ -228,24 +292,65 @@ def sync_scheduler(config):
     
     logger.info(f"Scheduler started - will sync every {config['sync']['interval_minutes']} minutes")
     
+    clients = create_clients(config)
+    
     # Perform initial sync (mark as first run)
-    perform_sync(config, is_first_run=True)
+    next_run = time.monotonic()
+    perform_sync(config, clients, is_first_run=True)
     
     # Then run on schedule (subsequent runs detect changes)
+    # Syncs start every interval_seconds, however long each one takes
     while True:
-        time.sleep(interval_seconds)
-        perform_sync(config, is_first_run=False)
+        next_run += interval_seconds
+        delay = next_run - time.monotonic()
+        if delay < 0:
+            # The sync overran its slot, start the next one now
+            logger.warning(f"Sync took longer than the {config['sync']['interval_minutes']} minutes interval")
+            next_run = time.monotonic()
+            delay = 0
+        if sync_trigger.wait(delay):
+            sync_trigger.clear()
+            if stop_scheduler.is_set():
+                clients['change_detector'].close()
+                if clients['notifier']:
+                    clients['notifier'].close()
+                logger.info("Scheduler stopped")
+                return
+            # On-demand sync, the next scheduled one comes a full interval later
+            logger.info("Sync requested")
+            next_run = time.monotonic()
+        perform_sync(config, clients, is_first_run=False)
+
+
+def stop_sync_scheduler():
+    """Stop the scheduler thread without waiting for the current interval to end"""
+    stop_scheduler.set()
+    sync_trigger.set()
+
+
+def handle_sigterm(signum, frame):
+    """Exit on SIGTERM (docker stop) the same way as on Ctrl+C, so the server returns"""
+    raise SystemExit(0)
 
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({
-        'status': sync_state['last_status'],
-        'last_run': sync_state['last_run'],
-        'last_error': sync_state['last_error'],
-        'events_synced': sync_state['events_synced']
-    })
+    return Response(health_body, mimetype='application/json')
+
+
+@app.route('/sync', methods=['POST'])
+def sync_now():
+    """Start a sync now, requires the SYNC_TRIGGER_TOKEN bearer token"""
+    token = app.config.get('SYNC_TRIGGER_TOKEN')
+    if not token:
+        return Response(status=404)
+    # Compared as bytes, compare_digest rejects non-ASCII str
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+        return Response(status=401)
+    
+    sync_trigger.set()
+    return Response(status=202)
 
 
 def main():
@@ -254,6 +359,8 @@ def main():
         # Load configuration
         logger.info("Loading configuration...")
         config = load_config()
+        app.config['SYNC_TRIGGER_TOKEN'] = config['app']['sync_token']
+        signal.signal(signal.SIGTERM, handle_sigterm)
         
         # Start sync scheduler in background thread
         scheduler_thread = threading.Thread(
@@ -269,7 +376,17 @@ def main():
         logger.info(f"Starting web server on {host}:{port}")
         logger.info(f"Health endpoint available at http://{host}:{port}/health")
         
-        app.run(host=host, port=port, debug=False)
+        try:
+            if serve:
+                serve(app, host=host, port=port, threads=config['app']['threads'],
+                      connection_limit=64, channel_timeout=30)
+            else:
+                logger.warning("waitress is not installed, using the Flask development server")
+                app.run(host=host, port=port, debug=False)
+        finally:
+            # The scheduler closes the state database and the notifier from its own thread
+            stop_sync_scheduler()
+            scheduler_thread.join(timeout=SHUTDOWN_TIMEOUT)
         
     except Exception as e:
         logger.error(f"Application error: {e}")
@@ -3,10 +3,17 @@ Push notification service using ntfy.sh
 """
 import requests
 import logging
-from typing import Optional
+from typing import Optional, List, Tuple
+from http_session import configure_session
 
 logger = logging.getLogger(__name__)
 
+# Above this many changes in one sync, send a single summary notification
+MAX_SEPARATE_NOTIFICATIONS = 3
+
+# Changes listed in a summary, the rest are only counted
+MAX_SUMMARY_LINES = 20
+
 class Notifier:
     """Send push notifications via ntfy.sh"""
     
@@ -23,6 +30,8 @@ class Notifier:
         self.server = server.rstrip('/')
         self.enabled = enabled
         self.url = f"{self.server}/{self.topic}"
+        # Keep the connection to the ntfy server open between notifications
+        self.session = configure_session(requests.Session())
         
     def send(self, title: str, message: str, priority: str = "default", tags: Optional[list] = None) -> bool:
         """
@@ -51,7 +60,7 @@ class Notifier:
                 headers["Tags"] = ",".join(tags)
             
             # Encode message as UTF-8 to handle emojis
-            response = requests.post(
+            response = self.session.post(
                 self.url,
                 data=message.encode('utf-8'),
                 headers=headers,
@@ -98,6 +107,51 @@ class Notifier:
             tags=["calendar", "pencil2"]
         )
     
+    def send_changes(
+        self,
+        new_shifts: List[Tuple[str, str, Optional[str]]],
+        deleted_shifts: List[Tuple[str, str, Optional[str]]],
+        modified_shifts: List[Tuple[str, str, str]]
+    ) -> bool:
+        """
+        Notify all changes of a sync, one notification each or a single summary if there are many
+        
+        Args:
+            new_shifts: List of (title, date, time) tuples
+            deleted_shifts: List of (title, date, time) tuples
+            modified_shifts: List of (title, old_info, new_info) tuples
+            
+        Returns:
+            True if every notification was sent successfully
+        """
+        count = len(new_shifts) + len(deleted_shifts) + len(modified_shifts)
+        if count == 0:
+            return True
+        
+        if count <= MAX_SEPARATE_NOTIFICATIONS:
+            results = [self.send_new_shift(*shift) for shift in new_shifts]
+            results += [self.send_deleted_shift(*shift) for shift in deleted_shifts]
+            results += [self.send_modified_shift(*shift) for shift in modified_shifts]
+            return all(results)
+        
+        # One POST for the whole sync
+        lines = [f"🆕 {title}{f' à {time}' if time else ''} le {date}" for title, date, time in new_shifts]
+        lines += [f"❌ {title}{f' à {time}' if time else ''} le {date}" for title, date, time in deleted_shifts]
+        lines += [f"✏️ {title} : {old_info} → {new_info}" for title, old_info, new_info in modified_shifts]
+        if len(lines) > MAX_SUMMARY_LINES:
+            # Keep the message well below ntfy's size limit
+            lines = lines[:MAX_SUMMARY_LINES] + [f"… et {count - MAX_SUMMARY_LINES} autres changements"]
+        return self.send(
+            title=f"Planning Modifie ({count})",  # ASCII-safe title
+            message='\n'.join(lines),
+            priority="default",
+            tags=["calendar"]
+        )
+    
+    def close(self):
+        """Close the pooled connections to the ntfy server"""
+        self.session.close()
+    
     def send_test(self) -> bool:
         """Send a test notification"""
         return self.send(
@@ -3,21 +3,25 @@
 Script de test pour les notifications
 """
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from notifier import Notifier
 import os
-from dotenv import load_dotenv
 
-# Load environment
-load_dotenv()
+# Sample notifications sent after the test one: label, Notifier method, arguments
+SAMPLES = (
+    ("Nouveau créneau", "send_new_shift", ("Work: 08:00-17:00", "Lundi 04 Nov", "08:00-17:00")),
+    ("Créneau supprimé", "send_deleted_shift", ("RTT", "Mardi 05 Nov")),
+    ("Créneau modifié", "send_modified_shift", ("Work: 08:00-17:00", "Lundi 04 Nov 08:00-17:00", "Lundi 04 Nov 07:00-16:00")),
+)
 
 def test_notifications():
     """Test sending notifications"""
     
     # Check if notifications are configured
     topic = os.getenv('NTFY_TOPIC')
+    server = os.getenv('NTFY_SERVER', 'https://ntfy.sh')
     enabled = os.getenv('ENABLE_NOTIFICATIONS', 'false').lower() == 'true'
     
     if not topic:
@@ -34,13 +38,14 @@ def test_notifications():
     
     print(f"✓ Configuration OK")
     print(f"  Topic: {topic}")
-    print(f"  Server: {os.getenv('NTFY_SERVER', 'https://ntfy.sh')}")
+    print(f"  Server: {server}")
     print()
     
-    # Create notifier
+    # Create notifier, only imported once there is something to send
+    from notifier import Notifier
     notifier = Notifier(
         topic=topic,
-        server=os.getenv('NTFY_SERVER', 'https://ntfy.sh'),
+        server=server,
         enabled=True
     )
     
@@ -56,23 +61,26 @@ def test_notifications():
         print("  Message: 🔔 Les notifications fonctionnent !")
         print()
         
-        # Send sample notifications
+        # Send sample notifications, concurrently as they don't depend on each other
         print("📱 Envoi d'exemples de notifications...")
         print()
         
-        print("  1. Nouveau créneau...")
-        notifier.send_new_shift("Work: 08:00-17:00", "Lundi 04 Nov", "08:00-17:00")
-        
-        print("  2. Créneau supprimé...")
-        notifier.send_deleted_shift("RTT", "Mardi 05 Nov")
-        
-        print("  3. Créneau modifié...")
-        notifier.send_modified_shift("Work: 08:00-17:00", "Lundi 04 Nov 08:00-17:00", "Lundi 04 Nov 07:00-16:00")
+        sent = []
+        with ThreadPoolExecutor(max_workers=len(SAMPLES)) as executor:
+            for i, (label, method, args) in enumerate(SAMPLES, 1):
+                print(f"  {i}. {label}...")
+                sent.append(executor.submit(getattr(notifier, method), *args))
         
+        failed = [f for f in sent if not f.result()]
         print()
+        if failed:
+            print(f"❌ {len(failed)} exemple(s) sur {len(sent)} n'ont pas pu être envoyés")
+            print()
+            return False
+        
         print("✓ Tous les exemples ont été envoyés !")
         print()
-        print("Vous devriez recevoir 4 notifications au total sur votre iPhone.")
+        print(f"Vous devriez recevoir {len(SAMPLES) + 1} notifications au total sur votre iPhone.")
         print()
         
         return True
@@ -81,9 +89,13 @@ def test_notifications():
         print("\nDépannage :")
         print("1. Vérifiez que votre NTFY_TOPIC est correct")
         print("2. Assurez-vous d'être abonné au topic dans l'application ntfy")
-        print("3. Essayez de visiter : https://ntfy.sh/" + topic)
+        print("3. Essayez de visiter :", notifier.url)
         return False
 
 if __name__ == '__main__':
+    # Load environment, once and only when run as a script and not already set
+    if not (os.environ.get('NTFY_TOPIC') and os.environ.get('ENABLE_NOTIFICATIONS')):
+        from dotenv import load_dotenv
+        load_dotenv()
     success = test_notifications()
     sys.exit(0 if success else 1)